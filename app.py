@@ -1,13 +1,21 @@
+import bisect
 import ctypes
 from ctypes import wintypes
+import ipaddress
+import heapq
+import itertools
 import json
+import math
 import os
 import re
+import socket
 import subprocess
 import sys
 import threading
 import time
 import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from tkinter import BOTH, CENTER, LEFT, Canvas, Frame, Label, Tk
 
@@ -28,6 +36,46 @@ WINDOW_HEIGHT = 500
 LOCAL_SOCKS_PORT = 10808
 LOCAL_HTTP_PORT = 10809
 API_PORT = 10085
+PAC_PORT = 10810
+
+PROXY_MODE_GLOBAL = "global"
+PROXY_MODE_PAC = "pac"
+DEFAULT_PAC_BYPASS = [
+    "localhost",
+    "local",
+    "lan",
+    "10.0.0.0/8",
+    "127.0.0.0/8",
+    "169.254.0.0/16",
+    "172.16.0.0/12",
+    "192.168.0.0/16",
+    "::1/128",
+    "fc00::/7",
+    "fe80::/10",
+]
+NODE_PROBE_LIMIT = 32
+NODE_RETRY_AFTER = 600
+
+TUN_DEFAULT_MTU = 1500
+TUN_MIN_MTU = 1280
+TUN_DEFAULT_STACK = "system"
+TUN_STACKS = ("system", "gvisor", "mixed")
+TUN_MTU_CACHE_TTL = 24 * 3600
+# Any routable public address works: connecting a UDP socket only picks the local source address.
+NETWORK_PROBE_ADDRESS = ("1.1.1.1", 53)
+TUN_THROUGHPUT_LOG = RUNTIME_DIR / "tun-throughput.jsonl"
+
+RESOURCE_SAMPLE_INTERVAL = 5.0
+RESOURCE_WINDOW = 120
+RSS_GROWTH_MB_PER_GB_LIMIT = 64.0
+CPU_PCT_PER_MBPS_LIMIT = 2.0
+IDLE_CPU_PCT_LIMIT = 25.0
+METRICS_PATH = RUNTIME_DIR / "xray-metrics.json"
+
+IP_ENTRY_RE = re.compile(r"^\d{1,3}(\.\d{1,3}){3}(/\d{1,2})?$")
+# Both mirror the regexes emitted into the PAC script, hence ASCII-only classes.
+IPV4_HOST_RE = re.compile(r"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}")
+HEX_GROUP_RE = re.compile(r"[0-9a-f]{1,4}")
 
 STATUS_OFF = "Отключен"
 
@@ -55,6 +103,9 @@ LR_SHARED = 0x00008000
 SPI_SETINTERNETOPTION = 39
 INTERNET_OPTION_SETTINGS_CHANGED = 39
 INTERNET_OPTION_REFRESH = 37
+CREATE_NO_WINDOW = 0x08000000 if os.name == "nt" else 0
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+TH32CS_SNAPTHREAD = 0x00000004
 
 
 class NOTIFYICONDATAW(ctypes.Structure):
@@ -207,7 +258,7 @@ def parse_vless_uri(uri: str) -> dict:
     return outbound
 
 
-def build_xray_config(profile: dict, tun_enabled: bool) -> dict:
+def profile_outbound(profile: dict) -> dict:
     if "outbound" in profile and isinstance(profile["outbound"], dict):
         outbound = profile["outbound"]
         if "tag" not in outbound:
@@ -216,6 +267,375 @@ def build_xray_config(profile: dict, tun_enabled: bool) -> dict:
         outbound = parse_vless_uri(profile["vless_uri"])
     else:
         raise ValueError("В profile.json нужен ключ outbound (объект) или vless_uri (строка)")
+    return outbound
+
+
+def outbound_address(outbound: dict) -> str | None:
+    servers = outbound.get("settings", {}).get("vnext") or outbound.get("settings", {}).get("servers") or []
+    if servers and isinstance(servers[0], dict):
+        return servers[0].get("address")
+    return None
+
+
+def configured_tun_mtu(profile: dict) -> int | None:
+    """Returns the fixed tun_mtu from profile.json, or None for "auto" (the default)."""
+    value = profile.get("tun_mtu", "auto")
+    if value == "auto":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('tun_mtu должен быть числом или "auto"')
+    try:
+        mtu = int(value)
+    except ValueError:
+        raise ValueError('tun_mtu должен быть числом или "auto"') from None
+    if not TUN_MIN_MTU <= mtu <= TUN_DEFAULT_MTU:
+        raise ValueError(f"tun_mtu должен быть в диапазоне {TUN_MIN_MTU}..{TUN_DEFAULT_MTU}")
+    return mtu
+
+
+def has_domain_rules(profile: dict) -> bool:
+    return any(isinstance(rule, dict) and rule.get("domain") for rule in profile.get("routing_rules", []))
+
+
+def tun_settings(profile: dict, mtu: int | None = None) -> dict:
+    """Resolves TUN stack/MTU/sniffing from profile.json; mtu is the discovered value for "auto"."""
+    stack = str(profile.get("tun_stack", TUN_DEFAULT_STACK)).lower()
+    if stack not in TUN_STACKS:
+        raise ValueError(f"tun_stack должен быть одним из: {', '.join(TUN_STACKS)}")
+
+    sniffing = profile.get("tun_sniffing", "auto")
+    if sniffing == "auto":
+        sniffing = has_domain_rules(profile)
+    elif not isinstance(sniffing, bool):
+        raise ValueError('tun_sniffing должен быть true, false или "auto"')
+
+    return {
+        "mtu": configured_tun_mtu(profile) or mtu or TUN_DEFAULT_MTU,
+        "stack": stack,
+        "sniffing": sniffing,
+    }
+
+
+def local_network_id() -> str:
+    """Local source address of the default route; identifies the network path MTU was measured on."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(NETWORK_PROBE_ADDRESS)
+            return sock.getsockname()[0]
+    except OSError:
+        return "offline"
+
+
+def discover_path_mtu(host: str, low: int = TUN_MIN_MTU, high: int = TUN_DEFAULT_MTU) -> int | None:
+    """Binary-searches the largest DF-set ICMP echo that reaches host. None if ICMP is blocked."""
+
+    def probe(mtu: int) -> bool:
+        size = str(mtu - 28)
+        if os.name == "nt":
+            cmd = ["ping", "-n", "1", "-w", "1000", "-f", "-l", size, host]
+        else:
+            cmd = ["ping", "-c", "1", "-W", "1", "-M", "do", "-s", size, host]
+        code, out, _ = run_cmd(cmd, timeout=3)
+        return code == 0 and "ttl=" in out.lower()
+
+    if not probe(low):
+        return None
+    if probe(high):
+        return high
+    while high - low > 1:
+        mid = (low + high) // 2
+        if probe(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def node_meta(uri: str) -> dict:
+    outbound = parse_vless_uri(uri)
+    server = outbound["settings"]["vnext"][0]
+    stream = outbound["streamSettings"]
+    return {
+        "uri": uri,
+        "type": stream["network"].lower(),
+        "security": stream["security"].lower(),
+        "host": server["address"].lower(),
+        "port": int(server["port"]),
+        "remark": urllib.parse.unquote(urllib.parse.urlparse(uri).fragment).strip().lower(),
+        "latency": None,
+        "failed_at": None,
+    }
+
+
+class NodeCatalog:
+    """In-memory node pool keyed by URI with per-field indexes and a latency-sorted index."""
+
+    FIELDS = ("type", "security", "host", "port", "remark")
+    MAX_SAMPLES = 20
+    # How far past its expected length a by_latency walk may run before falling back to intersecting.
+    SELECTIVE_RATIO = 2
+
+    def __init__(self):
+        self.nodes: dict[str, dict] = {}
+        self.index: dict[str, dict] = {field: {} for field in self.FIELDS}
+        self.samples: dict[str, list[float]] = {}
+        self.by_latency: list[tuple[float, str]] = []
+        self.position: dict[str, int] = {}
+        self.added = 0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, uri: str) -> dict | None:
+        uri = uri.strip()
+        if uri in self.nodes:
+            return self.nodes[uri]
+        try:
+            node = node_meta(uri)
+        except ValueError:
+            return None
+        self.nodes[uri] = node
+        self.position[uri] = self.added
+        self.added += 1
+        for field in self.FIELDS:
+            self.index[field].setdefault(node[field], set()).add(uri)
+        return node
+
+    def remove(self, uri: str) -> None:
+        node = self.nodes.pop(uri, None)
+        if node is None:
+            return
+        for field in self.FIELDS:
+            bucket = self.index[field].get(node[field])
+            if bucket is not None:
+                bucket.discard(uri)
+                if not bucket:
+                    del self.index[field][node[field]]
+        if node["latency"] is not None:
+            self._unindex_latency(uri, node["latency"])
+        self.samples.pop(uri, None)
+        del self.position[uri]
+
+    def sync(self, uris: list[str]) -> tuple[int, int]:
+        """Applies a subscription refresh incrementally; returns (added, removed)."""
+        # dict.fromkeys keeps subscription order, which is also the order unmeasured nodes get probed in.
+        wanted = dict.fromkeys(u.strip() for u in uris if u.strip() and not u.strip().startswith("#"))
+        stale = [u for u in self.nodes if u not in wanted]
+        for uri in stale:
+            self.remove(uri)
+        added = sum(1 for uri in wanted if uri not in self.nodes and self.add(uri) is not None)
+        return added, len(stale)
+
+    def record_latency(self, uri: str, ms: float | None) -> None:
+        """Stores a sample; the indexed latency is the p95 of the last MAX_SAMPLES samples.
+
+        A failed probe (ms is None) drops the node out of the latency index and stamps failed_at.
+        """
+        node = self.nodes.get(uri)
+        if node is None:
+            return
+        if ms is None:
+            if node["latency"] is not None:
+                self._unindex_latency(uri, node["latency"])
+                node["latency"] = None
+            node["failed_at"] = time.time()
+            self.samples.pop(uri, None)
+            return
+
+        node["failed_at"] = None
+        samples = self.samples.setdefault(uri, [])
+        samples.append(float(ms))
+        del samples[: -self.MAX_SAMPLES]
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+        if node["latency"] is not None:
+            self._unindex_latency(uri, node["latency"])
+        node["latency"] = p95
+        bisect.insort(self.by_latency, (p95, uri))
+
+    def _unindex_latency(self, uri: str, latency: float) -> None:
+        i = bisect.bisect_left(self.by_latency, (latency, uri))
+        if i < len(self.by_latency) and self.by_latency[i] == (latency, uri):
+            del self.by_latency[i]
+
+    def query(self, max_latency: float | None = None, limit: int | None = None, **filters) -> list[dict]:
+        """Filters by exact field values, sorted by latency; unmeasured nodes follow unless max_latency is set.
+
+        query(type="tcp", security="reality", max_latency=150, limit=20)
+        """
+        buckets = []
+        for field, value in filters.items():
+            if field not in self.FIELDS:
+                raise ValueError(f"Неизвестное поле фильтра: {field}")
+            if value is None:
+                continue
+            value = int(value) if field == "port" else str(value).lower()
+            buckets.append(self.index[field].get(value, set()))
+        buckets.sort(key=len)
+
+        limit = limit if limit is not None else len(self.nodes)
+        result = []
+        if limit <= 0 or not self.nodes:
+            return result
+
+        end = len(self.by_latency)
+        if max_latency is not None:
+            end = bisect.bisect_right(self.by_latency, (float(max_latency), "\uffff"))
+
+        # Expected walk length if the filters were independent, versus the cost of intersecting
+        # the smallest bucket. Filters that are broad on their own but barely overlap overrun the
+        # walk budget and switch to the intersection.
+        expected_walk = end
+        if buckets:
+            selectivity = math.prod(len(b) for b in buckets) / len(self.nodes) ** len(buckets)
+            expected_walk = min(end, limit / selectivity) if selectivity else 0
+
+        candidates = None
+        if buckets and len(buckets[0]) < expected_walk:
+            candidates = buckets[0].intersection(*buckets[1:])
+            result = self._nearest(candidates, end, limit)
+        else:
+            budget = self.SELECTIVE_RATIO * expected_walk if buckets else end
+            for walked, (_, uri) in enumerate(itertools.islice(self.by_latency, end)):
+                if walked >= budget:
+                    candidates = buckets[0].intersection(*buckets[1:])
+                    result = self._nearest(candidates, end, limit)
+                    break
+                for bucket in buckets:
+                    if uri not in bucket:
+                        break
+                else:
+                    result.append(self.nodes[uri])
+                    if len(result) >= limit:
+                        return result
+        if len(result) >= limit:
+            return result
+
+        if max_latency is None:
+            if candidates is None:
+                candidates = buckets[0].intersection(*buckets[1:]) if buckets else self.nodes
+            if candidates is self.nodes:
+                unmeasured = (uri for uri in self.nodes if self.nodes[uri]["latency"] is None)
+            else:
+                # Set order follows the hash seed; keep the subscription order instead.
+                unmeasured = [uri for uri in candidates if self.nodes[uri]["latency"] is None]
+                unmeasured = heapq.nsmallest(limit - len(result), unmeasured, key=self.position.__getitem__)
+            for uri in itertools.islice(unmeasured, limit - len(result)):
+                result.append(self.nodes[uri])
+        return result
+
+    def _nearest(self, candidates: set[str], end: int, limit: int) -> list[dict]:
+        if not end:
+            return []
+        bound = self.by_latency[end - 1][0]
+        measured = []
+        for uri in candidates:
+            latency = self.nodes[uri]["latency"]
+            if latency is not None and latency <= bound:
+                measured.append((latency, uri))
+        return [self.nodes[uri] for _, uri in heapq.nsmallest(limit, measured)]
+
+
+def probe_tcp_latency(host: str, port: int, timeout: float = 2.0) -> float | None:
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return (time.perf_counter() - start) * 1000.0
+    except OSError:
+        return None
+
+
+def probe_catalog(catalog: NodeCatalog, nodes: list[dict], workers: int = 16) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda n: probe_tcp_latency(n["host"], n["port"]), nodes))
+    for node, ms in zip(nodes, results):
+        catalog.record_latency(node["uri"], ms)
+
+
+def probe_candidates(catalog: NodeCatalog, filters: dict, limit: int = NODE_PROBE_LIMIT) -> list[dict]:
+    """Unmeasured nodes matching filters, skipping ones that failed within NODE_RETRY_AFTER."""
+    now = time.time()
+    result = []
+    for node in catalog.query(**filters):
+        if node["latency"] is not None:
+            continue
+        if node["failed_at"] is not None and now - node["failed_at"] < NODE_RETRY_AFTER:
+            continue
+        result.append(node)
+        if len(result) >= limit:
+            break
+    return result
+
+
+def select_node(catalog: NodeCatalog, node_filter: dict, probe_limit: int = NODE_PROBE_LIMIT) -> dict | None:
+    """Picks the lowest-latency reachable node matching node_filter, probing unmeasured candidates first.
+
+    Returns None when no matching node has answered a probe.
+    """
+    node_filter = dict(node_filter)
+    max_latency = node_filter.pop("max_latency", None)
+    candidates = probe_candidates(catalog, node_filter, probe_limit)
+    if candidates:
+        probe_catalog(catalog, candidates)
+    best = catalog.query(max_latency=math.inf if max_latency is None else max_latency, limit=1, **node_filter)
+    return best[0] if best else None
+
+
+def read_node_list(path: Path) -> list[str]:
+    return [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip() and not line.lstrip().startswith("#")]
+
+
+def benchmark_catalog(count: int = 50000, queries: int = 1000) -> dict:
+    """Times build, latency indexing, typical queries and an incremental refresh on count nodes."""
+    import random
+
+    rnd = random.Random(1)
+    uris = []
+    for i in range(count):
+        # reality only comes with tcp, so reality+grpc exercises filters that are broad but disjoint.
+        security = rnd.choice(["reality", "tls", "none"])
+        network = "tcp" if security == "reality" else rnd.choice(["tcp", "ws", "grpc", "xhttp"])
+        uris.append(f"vless://id{i}@n{i}.example.com:{rnd.choice([443, 8443, 2053])}?security={security}&type={network}#node-{i % 500}")
+
+    catalog = NodeCatalog()
+    t0 = time.perf_counter()
+    catalog.sync(uris)
+    t1 = time.perf_counter()
+    for uri in uris:
+        catalog.record_latency(uri, rnd.uniform(20, 400))
+    t2 = time.perf_counter()
+
+    cases = {
+        "reality_tcp_150ms": {"security": "reality", "type": "tcp", "max_latency": 150, "limit": 20},
+        "reality_grpc_150ms": {"security": "reality", "type": "grpc", "max_latency": 150, "limit": 20},
+        "host_400ms": {"host": "n42.example.com", "max_latency": 400, "limit": 20},
+        "remark": {"remark": "node-5", "limit": 20},
+    }
+    query_us = {}
+    for name, query in cases.items():
+        start = time.perf_counter()
+        for _ in range(queries):
+            catalog.query(**query)
+        query_us[name] = (time.perf_counter() - start) * 1e6 / queries
+
+    t3 = time.perf_counter()
+    catalog.sync(uris[: count - 1000] + [u.replace("vless://id", "vless://new") for u in uris[:1000]])
+    t4 = time.perf_counter()
+
+    return {
+        "nodes": len(catalog),
+        "build_ms": (t1 - t0) * 1000.0,
+        "latency_index_ms": (t2 - t1) * 1000.0,
+        "query_us": query_us,
+        "refresh_1000_ms": (t4 - t3) * 1000.0,
+    }
+
+
+def build_xray_config(profile: dict, tun_enabled: bool, tun: dict | None = None) -> dict:
+    outbound = profile_outbound(profile)
 
     inbounds = [
         {
@@ -242,19 +662,27 @@ def build_xray_config(profile: dict, tun_enabled: bool) -> dict:
     ]
 
     if tun_enabled:
-        inbounds.append(
-            {
-                "tag": "tun-in",
-                "protocol": "tun",
-                "settings": {
-                    "name": "xray-tun",
-                    "mtu": 1500,
-                    "stack": "system",
-                    "autoRoute": True,
-                    "strictRoute": True,
-                },
+        tun = tun or tun_settings(profile)
+        tun_inbound = {
+            "tag": "tun-in",
+            "protocol": "tun",
+            "settings": {
+                "name": "xray-tun",
+                "mtu": tun["mtu"],
+                "stack": tun["stack"],
+                "autoRoute": True,
+                "strictRoute": True,
+            },
+        }
+        if tun["sniffing"]:
+            # Sniffing runs on every connection; routeOnly makes the sniffed domain visible to
+            # domain routing rules without overriding the destination xray dials.
+            tun_inbound["sniffing"] = {
+                "enabled": True,
+                "destOverride": ["http", "tls", "quic"],
+                "routeOnly": True,
             }
-        )
+        inbounds.append(tun_inbound)
 
     config = {
         "log": {
@@ -292,32 +720,535 @@ def build_xray_config(profile: dict, tun_enabled: bool) -> dict:
             ],
         },
     }
+    for rule in profile.get("routing_rules", []):
+        if isinstance(rule, dict):
+            config["routing"]["rules"].append({"type": "field", **rule})
     return config
 
 
 def run_cmd(cmd: list[str], timeout: float = 8.0) -> tuple[int, str, str]:
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, creationflags=0x08000000)
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, creationflags=CREATE_NO_WINDOW)
         return proc.returncode, proc.stdout.strip(), proc.stderr.strip()
     except Exception as exc:
         return 1, "", str(exc)
 
 
-def set_system_proxy(enabled: bool) -> None:
+def set_system_proxy(enabled: bool, pac_url: str | None = None, restore_pac_url: str | None = None) -> str | None:
+    """Switches WinINet to the local proxy or PAC URL; returns the AutoConfigURL found before the change.
+
+    AutoConfigURL is only touched when it is ours: on disable it is restored to restore_pac_url
+    (or removed), so a PAC URL set by IT survives global mode and disconnects.
+    """
     import winreg
 
     key_path = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
-    with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_SET_VALUE) as key:
-        if enabled:
+    access = winreg.KEY_SET_VALUE | winreg.KEY_QUERY_VALUE
+    with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, access) as key:
+        current = _read_reg_value(winreg, key, "AutoConfigURL")
+        if enabled and pac_url:
+            winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+            winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, pac_url)
+        elif enabled:
             winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 1)
             winreg.SetValueEx(key, "ProxyServer", 0, winreg.REG_SZ, f"127.0.0.1:{LOCAL_HTTP_PORT}")
             winreg.SetValueEx(key, "ProxyOverride", 0, winreg.REG_SZ, "<local>")
         else:
             winreg.SetValueEx(key, "ProxyEnable", 0, winreg.REG_DWORD, 0)
+            if is_own_pac_url(current):
+                if restore_pac_url:
+                    winreg.SetValueEx(key, "AutoConfigURL", 0, winreg.REG_SZ, restore_pac_url)
+                else:
+                    _delete_reg_value(winreg, key, "AutoConfigURL")
 
     wininet = ctypes.WinDLL("wininet", use_last_error=True)
     wininet.InternetSetOptionW(0, INTERNET_OPTION_SETTINGS_CHANGED, 0, 0)
     wininet.InternetSetOptionW(0, INTERNET_OPTION_REFRESH, 0, 0)
+    return current
+
+
+def is_own_pac_url(url: str | None) -> bool:
+    return bool(url) and url.startswith(f"http://127.0.0.1:{PAC_PORT}/")
+
+
+def _read_reg_value(winreg, key, name: str) -> str | None:
+    try:
+        return winreg.QueryValueEx(key, name)[0]
+    except FileNotFoundError:
+        return None
+
+
+def _delete_reg_value(winreg, key, name: str) -> None:
+    try:
+        winreg.DeleteValue(key, name)
+    except FileNotFoundError:
+        pass
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def compile_bypass(entries: list[str]) -> dict:
+    """Splits bypass entries into domain suffixes and merged, sorted IPv4/IPv6 ranges.
+
+    Domains match themselves and any subdomain ("corp.local" covers "a.corp.local").
+    IPv4 ranges are integers; IPv6 ranges are 32-char hex strings, which sort like the numbers.
+    """
+    suffixes = set()
+    v4 = []
+    v6 = []
+    for raw in entries:
+        entry = raw.strip().lower()
+        if not entry or entry.startswith("#"):
+            continue
+        if not (IP_ENTRY_RE.match(entry) or ":" in entry):
+            suffixes.add(entry.lstrip("*").strip("."))
+            continue
+        try:
+            net = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        span = (int(net.network_address), int(net.broadcast_address))
+        (v4 if net.version == 4 else v6).append(span)
+
+    suffixes.discard("")
+    v4 = _merge_ranges(v4)
+    v6 = _merge_ranges(v6)
+    return {
+        "suffixes": frozenset(suffixes),
+        "v4_starts": [r[0] for r in v4],
+        "v4_ends": [r[1] for r in v4],
+        "v6_starts": [f"{r[0]:032x}" for r in v6],
+        "v6_ends": [f"{r[1]:032x}" for r in v6],
+    }
+
+
+def ipv6_hex(host: str) -> str | None:
+    """Expands an IPv6 literal to 32 hex chars exactly like v6hex() in the PAC script."""
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    i = host.find("%")
+    if i >= 0:
+        host = host[:i]
+    parts = host.split("::")
+    if len(parts) > 2:
+        return None
+    head = parts[0].split(":") if parts[0] else []
+    tail = parts[1].split(":") if len(parts) == 2 and parts[1] else []
+    fill = 8 - len(head) - len(tail)
+    if fill < 0 or (len(parts) == 1 and fill != 0):
+        return None
+    groups = head + ["0"] * fill + tail
+    if not all(HEX_GROUP_RE.fullmatch(g) for g in groups):
+        return None
+    return "".join(g.rjust(4, "0") for g in groups)
+
+
+def _in_ranges(starts: list, ends: list, value) -> bool:
+    i = bisect.bisect_right(starts, value) - 1
+    return i >= 0 and value <= ends[i]
+
+
+def bypass_matches(host: str, compiled: dict) -> bool:
+    """Python mirror of FindProxyForURL() in the generated PAC script; True means DIRECT."""
+    host = host.lower()
+    if ":" in host:
+        key = ipv6_hex(host)
+        return key is not None and _in_ranges(compiled["v6_starts"], compiled["v6_ends"], key)
+    if "." not in host:
+        return True
+    suffixes = compiled["suffixes"]
+    h = host
+    while True:
+        if h in suffixes:
+            return True
+        i = h.find(".")
+        if i < 0:
+            break
+        h = h[i + 1 :]
+    if IPV4_HOST_RE.fullmatch(host):
+        p = [int(x) for x in host.split(".")]
+        ip = p[0] * 16777216 + p[1] * 65536 + p[2] * 256 + p[3]
+        return _in_ranges(compiled["v4_starts"], compiled["v4_ends"], ip)
+    return False
+
+
+def render_pac_script(compiled: dict, proxy: str | None = None) -> str:
+    proxy = proxy or f"PROXY 127.0.0.1:{LOCAL_HTTP_PORT}"
+
+    def js(value) -> str:
+        return json.dumps(value, separators=(",", ":"))
+
+    return f"""var S = {js(dict.fromkeys(sorted(compiled["suffixes"]), 1))};
+var RS = {js(compiled["v4_starts"])};
+var RE = {js(compiled["v4_ends"])};
+var R6S = {js(compiled["v6_starts"])};
+var R6E = {js(compiled["v6_ends"])};
+var IPV4 = /^[0-9]{{1,3}}\\.[0-9]{{1,3}}\\.[0-9]{{1,3}}\\.[0-9]{{1,3}}$/;
+var HEX = /^[0-9a-f]{{1,4}}$/;
+
+function inRanges(starts, ends, v) {{
+  var lo = 0, hi = starts.length - 1;
+  while (lo <= hi) {{
+    var mid = (lo + hi) >> 1;
+    if (starts[mid] > v) hi = mid - 1;
+    else if (ends[mid] < v) lo = mid + 1;
+    else return true;
+  }}
+  return false;
+}}
+
+function v6hex(h) {{
+  if (h.charAt(0) == "[" && h.charAt(h.length - 1) == "]") h = h.substring(1, h.length - 1);
+  var z = h.indexOf("%");
+  if (z >= 0) h = h.substring(0, z);
+  var parts = h.split("::");
+  if (parts.length > 2) return null;
+  var head = parts[0] ? parts[0].split(":") : [];
+  var tail = parts.length == 2 && parts[1] ? parts[1].split(":") : [];
+  var fill = 8 - head.length - tail.length;
+  if (fill < 0 || (parts.length == 1 && fill != 0)) return null;
+  var groups = head;
+  for (var k = 0; k < fill; k++) groups.push("0");
+  groups = groups.concat(tail);
+  var out = "";
+  for (var g = 0; g < 8; g++) {{
+    if (!HEX.test(groups[g])) return null;
+    out += "0000".substring(groups[g].length) + groups[g];
+  }}
+  return out;
+}}
+
+function FindProxyForURL(url, host) {{
+  host = host.toLowerCase();
+  if (host.indexOf(":") >= 0) {{
+    var key = v6hex(host);
+    return key !== null && inRanges(R6S, R6E, key) ? "DIRECT" : "{proxy}";
+  }}
+  if (host.indexOf(".") < 0) return "DIRECT";
+  var h = host;
+  while (true) {{
+    if (Object.prototype.hasOwnProperty.call(S, h)) return "DIRECT";
+    var i = h.indexOf(".");
+    if (i < 0) break;
+    h = h.substring(i + 1);
+  }}
+  if (IPV4.test(host)) {{
+    var p = host.split(".");
+    var ip = ((+p[0]) * 16777216) + ((+p[1]) * 65536) + ((+p[2]) * 256) + (+p[3]);
+    if (inRanges(RS, RE, ip)) return "DIRECT";
+  }}
+  return "{proxy}";
+}}
+"""
+
+
+def build_pac_script(entries: list[str], proxy: str | None = None) -> str:
+    return render_pac_script(compile_bypass(entries), proxy)
+
+
+def load_pac_bypass(profile: dict) -> list[str]:
+    entries = list(DEFAULT_PAC_BYPASS)
+    extra = profile.get("pac_bypass", [])
+    if isinstance(extra, str):
+        extra = extra.splitlines()
+    entries.extend(str(x) for x in extra)
+    return entries
+
+
+def eval_pac_with_node(script: str, hosts: list[str], timeout: float = 120.0) -> dict | None:
+    """Runs the emitted FindProxyForURL() under node for every host; None when node is not installed."""
+    import shutil
+    import tempfile
+
+    node = shutil.which("node")
+    if node is None:
+        return None
+    harness = script + f"""
+var H = {json.dumps(hosts)};
+var R = new Array(H.length);
+var t0 = process.hrtime.bigint();
+for (var n = 0; n < H.length; n++) R[n] = FindProxyForURL("", H[n]);
+var t1 = process.hrtime.bigint();
+console.log(JSON.stringify({{ns: Number(t1 - t0), results: R}}));
+"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "pac-eval.js"
+        path.write_text(harness, encoding="utf-8")
+        code, out, err = run_cmd([node, str(path)], timeout=timeout)
+    if code != 0:
+        raise RuntimeError(err or out or "node завершился с ошибкой")
+    return json.loads(out)
+
+
+def benchmark_pac(domains: int = 50000, cidrs: int = 20000, lookups: int = 200000) -> dict:
+    """Times compile, render and lookups on synthetic lists of the given size.
+
+    pac_lookup_us is FindProxyForURL() itself under node (None without node);
+    mirror_lookup_us is the Python bypass_matches() mirror.
+    """
+    import random
+
+    rnd = random.Random(1)
+    entries = [f"d{i}.example{i % 97}.ru" for i in range(domains)]
+    entries += [f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.0/24" for _ in range(cidrs)]
+    hosts = [f"www.d{rnd.randrange(domains * 2)}.example{rnd.randrange(97)}.ru" for _ in range(lookups // 2)]
+    hosts += [f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}" for _ in range(lookups // 2)]
+
+    t0 = time.perf_counter()
+    compiled = compile_bypass(entries)
+    t1 = time.perf_counter()
+    script = render_pac_script(compiled)
+    t2 = time.perf_counter()
+    hits = sum(1 for host in hosts if bypass_matches(host, compiled))
+    t3 = time.perf_counter()
+
+    result = {
+        "entries": len(entries),
+        "pac_bytes": len(script),
+        "compile_ms": (t1 - t0) * 1000.0,
+        "render_ms": (t2 - t1) * 1000.0,
+        "lookups": len(hosts),
+        "direct_hits": hits,
+        "mirror_lookup_us": (t3 - t2) * 1e6 / max(1, len(hosts)),
+        "pac_lookup_us": None,
+    }
+    evaluated = eval_pac_with_node(script, hosts)
+    if evaluated is not None:
+        result["pac_lookup_us"] = evaluated["ns"] / 1000.0 / max(1, len(hosts))
+        result["pac_direct_hits"] = sum(1 for r in evaluated["results"] if r == "DIRECT")
+    return result
+
+
+def record_tun_throughput(tun: dict, total_bytes: float, seconds: float, peak_kbps: float) -> None:
+    """Appends one line per TUN session so throughput can be compared across MTU/stack/sniffing changes."""
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mtu": tun["mtu"],
+        "stack": tun["stack"],
+        "sniffing": tun["sniffing"],
+        "bytes": int(total_bytes),
+        "seconds": round(seconds, 1),
+        "avg_kbps": round(total_bytes * 8.0 / 1000.0 / seconds, 2),
+        "peak_kbps": round(peak_kbps, 2),
+    }
+    try:
+        with TUN_THROUGHPUT_LOG.open("a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+def _read_proc_linux(pid: int) -> dict:
+    with open(f"/proc/{pid}/stat", "rb") as fh:
+        stat = fh.read().decode("ascii", "replace")
+    # comm may contain spaces; fields after ")" are fixed-position (state is field 3).
+    fields = stat[stat.rindex(")") + 2 :].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "threads": int(fields[17]),
+        "rss_bytes": int(fields[21]) * os.sysconf("SC_PAGE_SIZE"),
+        "handles": len(os.listdir(f"/proc/{pid}/fd")),
+    }
+
+
+class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+    _fields_ = [
+        ("cb", wintypes.DWORD),
+        ("PageFaultCount", wintypes.DWORD),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+class THREADENTRY32(ctypes.Structure):
+    _fields_ = [
+        ("dwSize", wintypes.DWORD),
+        ("cntUsage", wintypes.DWORD),
+        ("th32ThreadID", wintypes.DWORD),
+        ("th32OwnerProcessID", wintypes.DWORD),
+        ("tpBasePri", ctypes.c_long),
+        ("tpDeltaPri", ctypes.c_long),
+        ("dwFlags", wintypes.DWORD),
+    ]
+
+
+def _count_threads_windows(pid: int) -> int:
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    snap = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPTHREAD, 0)
+    if not snap or snap == wintypes.HANDLE(-1).value:
+        raise OSError(ctypes.get_last_error(), "CreateToolhelp32Snapshot failed")
+    count = 0
+    try:
+        entry = THREADENTRY32()
+        entry.dwSize = ctypes.sizeof(THREADENTRY32)
+        ok = kernel32.Thread32First(snap, ctypes.byref(entry))
+        while ok:
+            if entry.th32OwnerProcessID == pid:
+                count += 1
+            ok = kernel32.Thread32Next(snap, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snap)
+    return count
+
+
+def _read_proc_windows(pid: int) -> dict:
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    psapi = ctypes.WinDLL("psapi", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        raise OSError(ctypes.get_last_error(), "OpenProcess failed")
+    try:
+        creation, exit_, kernel, user = (wintypes.FILETIME() for _ in range(4))
+        # A failed call would leave zeros behind and corrupt the CPU/RSS deltas, so fail the sample instead.
+        if not kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_), ctypes.byref(kernel), ctypes.byref(user)):
+            raise OSError(ctypes.get_last_error(), "GetProcessTimes failed")
+        cpu_100ns = sum((ft.dwHighDateTime << 32) | ft.dwLowDateTime for ft in (kernel, user))
+
+        mem = PROCESS_MEMORY_COUNTERS()
+        mem.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+        if not psapi.GetProcessMemoryInfo(handle, ctypes.byref(mem), mem.cb):
+            raise OSError(ctypes.get_last_error(), "GetProcessMemoryInfo failed")
+
+        handles = wintypes.DWORD()
+        if not kernel32.GetProcessHandleCount(handle, ctypes.byref(handles)):
+            raise OSError(ctypes.get_last_error(), "GetProcessHandleCount failed")
+    finally:
+        kernel32.CloseHandle(handle)
+
+    return {
+        "cpu_seconds": cpu_100ns / 1e7,
+        "threads": _count_threads_windows(pid),
+        "rss_bytes": int(mem.WorkingSetSize),
+        "handles": int(handles.value),
+    }
+
+
+def read_process_resources(pid: int) -> dict:
+    """CPU time, RSS, thread and handle/fd counts of a process (/proc on Linux, Win32 on Windows)."""
+    if os.name == "nt":
+        return _read_proc_windows(pid)
+    return _read_proc_linux(pid)
+
+
+class ResourceMonitor:
+    """Keeps xray resource samples next to the cumulative traffic counter and flags anomalies.
+
+    Anomalies are computed over the retained window so a single GC spike does not trigger them:
+    RSS growth per GB transferred and CPU percent per Mbps of throughput.
+    """
+
+    def __init__(self, window: int = RESOURCE_WINDOW):
+        self.samples: deque[dict] = deque(maxlen=window)
+        self.sampler_seconds = 0.0
+        self.started = time.time()
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.sampler_seconds = 0.0
+        self.started = time.time()
+
+    def sample(self, pid: int, total_bytes: float | None) -> dict | None:
+        """Skipped when the traffic counter is unknown: a stand-in zero would fake idle CPU or a traffic burst."""
+        if total_bytes is None:
+            return None
+        t0 = time.thread_time()
+        try:
+            sample = read_process_resources(pid)
+        except (OSError, ValueError, IndexError):
+            return None
+        finally:
+            self.sampler_seconds += time.thread_time() - t0
+        sample["time"] = time.time()
+        sample["total_bytes"] = float(total_bytes)
+        self.samples.append(sample)
+        return sample
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        last = self.samples[-1]
+        result = {
+            "cpu_seconds": round(last["cpu_seconds"], 2),
+            "rss_mb": round(last["rss_bytes"] / 1048576.0, 1),
+            "threads": last["threads"],
+            "handles": last["handles"],
+            "total_bytes": int(last["total_bytes"]),
+            "sampler_cpu_pct": round(100.0 * self.sampler_seconds / max(1.0, last["time"] - self.started), 3),
+            "anomalies": [],
+        }
+        if len(self.samples) < 2:
+            return result
+
+        first = self.samples[0]
+        elapsed = max(0.001, last["time"] - first["time"])
+        transferred = max(0.0, last["total_bytes"] - first["total_bytes"])
+        cpu_pct = 100.0 * max(0.0, last["cpu_seconds"] - first["cpu_seconds"]) / elapsed
+        mbps = transferred * 8.0 / 1e6 / elapsed
+        result["cpu_pct"] = round(cpu_pct, 1)
+        result["mbps"] = round(mbps, 2)
+
+        rss_growth_mb = (last["rss_bytes"] - first["rss_bytes"]) / 1048576.0
+        if transferred >= 0.1 * 1e9:
+            per_gb = rss_growth_mb / (transferred / 1e9)
+            result["rss_mb_per_gb"] = round(per_gb, 1)
+            if per_gb > RSS_GROWTH_MB_PER_GB_LIMIT:
+                result["anomalies"].append(f"RSS +{per_gb:.0f} MB/GB")
+        if mbps >= 1.0:
+            per_mbps = cpu_pct / mbps
+            result["cpu_pct_per_mbps"] = round(per_mbps, 2)
+            if per_mbps > CPU_PCT_PER_MBPS_LIMIT:
+                result["anomalies"].append(f"CPU {per_mbps:.1f}%/Mbps")
+        elif cpu_pct > IDLE_CPU_PCT_LIMIT:
+            result["anomalies"].append(f"CPU {cpu_pct:.0f}% без трафика")
+        return result
+
+
+class PacServer:
+    def __init__(self, script: str, port: int = PAC_PORT):
+        body = script.encode("utf-8")
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        # The timestamp forces WinINet to refetch instead of using a cached script.
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/proxy.pac?t={int(time.time())}"
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
 
 def create_autostart_task() -> tuple[bool, str]:
@@ -497,7 +1428,21 @@ class VPNApp:
         self.drag_y = 0
 
         self.connected = False
+        self.busy = False
+        self.stopping = False
         self.xray_proc: subprocess.Popen | None = None
+        self.pac_server: PacServer | None = None
+        self.catalog = NodeCatalog()
+        self.resources = ResourceMonitor()
+        self.last_resource_sample = 0.0
+        self.session_tun: dict | None = None
+        self.mtu_probes: set[str] = set()
+        self.pending_mtu_probes: dict[str, str] = {}
+        self.tun_active = False
+        self.tun_epoch = 0
+        self.session_bytes = 0.0
+        self.session_seconds = 0.0
+        self.session_peak_kbps = 0.0
         self.last_total_bytes: float | None = None
         self.last_sample_time: float | None = None
         self.status_text = "Готов"
@@ -550,6 +1495,9 @@ class VPNApp:
         self.speed_label = Label(content, text="0.00 Kbps", fg="#aaaaaa", bg="#2e2e2e")
         self.speed_label.place(relx=0.5, rely=0.81, anchor=CENTER)
 
+        self.resource_label = Label(content, text="", fg="#888888", bg="#2e2e2e", wraplength=220, justify=CENTER)
+        self.resource_label.place(relx=0.5, rely=0.87, anchor=CENTER)
+
         self._draw_power_button()
         self._draw_tun_switch()
 
@@ -586,66 +1534,135 @@ class VPNApp:
         self.root.focus_force()
 
     def set_status(self, text: str):
+        # Called from the connect worker as well, so the widget update goes through the Tk loop.
         self.status_text = text
-        self.status_label.config(text=text)
+        self.root.after(0, lambda: self.status_label.config(text=text))
+
+    def _run_busy(self, work):
+        """Runs connect/disconnect work off the Tk thread; clicks are ignored until it finishes."""
+        if self.busy or self.stopping:
+            return
+        self.busy = True
+
+        def runner():
+            try:
+                work()
+            finally:
+                self.busy = False
+                self.root.after(0, self._draw_power_button)
+
+        threading.Thread(target=runner, daemon=True).start()
 
     def toggle_tun(self):
+        if self.busy:
+            return
         self.state["tun_enabled"] = not bool(self.state.get("tun_enabled", False))
         save_json(STATE_PATH, self.state)
         self._draw_tun_switch()
 
         if self.connected:
-            self.set_status("Перезапуск для применения TUN...")
-            self.disconnect()
-            ok, msg = self.connect()
-            self.set_status(msg)
-            self._draw_power_button()
+
+            def restart():
+                self.set_status("Перезапуск для применения TUN...")
+                self.disconnect()
+                ok, msg = self.connect()
+                self.set_status(msg)
+
+            self._run_busy(restart)
 
     def toggle_connection(self):
-        if self.connected:
-            self.disconnect()
-            self.set_status("Отключен")
-        else:
-            ok, msg = self.connect()
-            self.set_status(msg)
-        self._draw_power_button()
+        def work():
+            if self.connected:
+                self.disconnect()
+                self.set_status("Отключен")
+            else:
+                ok, msg = self.connect()
+                self.set_status(msg)
+
+        self._run_busy(work)
 
     def connect(self) -> tuple[bool, str]:
         if not XRAY_EXE.exists():
             return False, f"Не найден {XRAY_EXE}"
 
         profile = load_json(PROFILE_PATH, {})
+        if isinstance(profile.get("nodes"), list) and "outbound" not in profile:
+            self.catalog.sync([str(x) for x in profile["nodes"]])
+            self.set_status("Выбор узла...")
+            try:
+                node = select_node(self.catalog, profile.get("node_filter", {}))
+            except (TypeError, ValueError) as exc:
+                return False, f"Ошибка node_filter: {exc}"
+            if node is None:
+                return False, "Нет доступных узлов под node_filter"
+            profile = dict(profile, vless_uri=node["uri"])
+
+        tun_enabled = bool(self.state.get("tun_enabled", False))
         try:
-            config = build_xray_config(profile, bool(self.state.get("tun_enabled", False)))
+            tun = self._resolve_tun_settings(profile) if tun_enabled else None
+            config = build_xray_config(profile, tun_enabled, tun)
         except Exception as exc:
             return False, f"Ошибка profile.json: {exc}"
 
         ACTIVE_CONFIG_PATH.write_text(json.dumps(config, indent=2, ensure_ascii=False), encoding="utf-8")
 
+        if self.stopping:
+            return False, "Отменено"
+
+        if tun is not None:
+            # Marks the TUN window before xray can bring the adapter up; see _probe_mtu().
+            self.tun_active = True
+            self.tun_epoch += 1
+
         cmd = [str(XRAY_EXE), "run", "-c", str(ACTIVE_CONFIG_PATH)]
         try:
             self.xray_proc = subprocess.Popen(
                 cmd,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
-                creationflags=0x08000000,
+                creationflags=CREATE_NO_WINDOW,
             )
         except Exception as exc:
+            self.tun_active = False
             return False, f"Не удалось запустить xray: {exc}"
 
         time.sleep(0.8)
         if self.xray_proc.poll() is not None:
+            self.xray_proc = None
+            self.tun_active = False
             return False, "xray завершился сразу после запуска"
 
+        if self.stopping:
+            self.disconnect()
+            return False, "Отменено"
+
+        pac_url = None
+        if profile.get("proxy_mode", PROXY_MODE_GLOBAL) == PROXY_MODE_PAC:
+            try:
+                self.pac_server = PacServer(build_pac_script(load_pac_bypass(profile)))
+                pac_url = self.pac_server.url
+            except Exception as exc:
+                self.disconnect()
+                return False, f"Не удалось запустить PAC-сервер: {exc}"
+
         try:
-            set_system_proxy(True)
+            previous_pac_url = set_system_proxy(True, pac_url)
         except Exception as exc:
             self.disconnect()
             return False, f"Не удалось включить системный прокси: {exc}"
+        if pac_url and not is_own_pac_url(previous_pac_url):
+            self.state["saved_pac_url"] = previous_pac_url
+            save_json(STATE_PATH, self.state)
 
         self.connected = True
         self.last_total_bytes = None
         self.last_sample_time = None
+        self.session_tun = tun
+        self.session_bytes = 0.0
+        self.session_seconds = 0.0
+        self.session_peak_kbps = 0.0
+        self.resources.reset()
+        self.last_resource_sample = 0.0
 
         if not self.state.get("autostart_done", False):
             ok, _ = create_autostart_task()
@@ -655,12 +1672,63 @@ class VPNApp:
 
         return True, "Подключено"
 
+    def _resolve_tun_settings(self, profile: dict) -> dict:
+        """Uses a fresh cached path MTU for this node and network; otherwise queues a probe for after
+        the TUN session ends and connects with the default, so the value applies from the next connect."""
+        if configured_tun_mtu(profile) is not None:
+            return tun_settings(profile)
+
+        host = outbound_address(profile_outbound(profile))
+        if not host:
+            return tun_settings(profile)
+        key = f"{host}@{local_network_id()}"
+        entry = self.state.get("tun_mtu_cache", {}).get(key)
+        if isinstance(entry, dict) and time.time() - entry.get("checked", 0) < TUN_MTU_CACHE_TTL:
+            return tun_settings(profile, entry.get("mtu"))
+
+        self.pending_mtu_probes[key] = host
+        return tun_settings(profile)
+
+    def _start_mtu_probes(self):
+        if self.tun_active:
+            return
+        for key, host in list(self.pending_mtu_probes.items()):
+            if key not in self.mtu_probes:
+                self.mtu_probes.add(key)
+                threading.Thread(target=self._probe_mtu, args=(host, key, self.tun_epoch), daemon=True).start()
+
+    def _probe_mtu(self, host: str, key: str, epoch: int):
+        # Pings sent while the TUN adapter is up go into the tunnel, which drops ICMP, so only a
+        # probe that ran entirely outside a TUN session measures the physical path.
+        mtu = discover_path_mtu(host)
+        self.root.after(0, lambda: self._store_mtu(key, mtu, epoch))
+
+    def _store_mtu(self, key: str, mtu: int | None, epoch: int):
+        self.mtu_probes.discard(key)
+        if self.tun_active or epoch != self.tun_epoch:
+            return
+        self.pending_mtu_probes.pop(key, None)
+        # None (ICMP blocked) is cached as well so the probe is not repeated on every connect.
+        self.state.setdefault("tun_mtu_cache", {})[key] = {"mtu": mtu, "checked": time.time()}
+        save_json(STATE_PATH, self.state)
+
     def disconnect(self):
         try:
-            set_system_proxy(False)
+            set_system_proxy(False, restore_pac_url=self.state.get("saved_pac_url"))
+            if "saved_pac_url" in self.state:
+                del self.state["saved_pac_url"]
+                save_json(STATE_PATH, self.state)
         except Exception:
             pass
 
+        pac_server = self.pac_server
+        self.pac_server = None
+        if pac_server is not None:
+            try:
+                pac_server.stop()
+            except Exception:
+                pass
+
         proc = self.xray_proc
         self.xray_proc = None
 
@@ -674,10 +1742,18 @@ class VPNApp:
                 except Exception:
                     pass
 
+        if self.session_tun is not None and self.session_seconds > 0:
+            record_tun_throughput(self.session_tun, self.session_bytes, self.session_seconds, self.session_peak_kbps)
+        self.session_tun = None
+        self.tun_active = False
+        if not self.stats_stop:
+            self._start_mtu_probes()
+
         self.connected = False
         self.last_total_bytes = None
         self.last_sample_time = None
-        self.speed_label.config(text="0.00 Kbps")
+        self.root.after(0, lambda: self.speed_label.config(text="0.00 Kbps"))
+        self.root.after(0, lambda: self.resource_label.config(text=""))
 
     def on_close_click(self):
         self.shutdown()
@@ -686,7 +1762,14 @@ class VPNApp:
         self.shutdown()
 
     def shutdown(self):
+        self.stopping = True
         self.stats_stop = True
+        if self.busy:
+            # connect() checks self.stopping before starting xray and before touching the proxy;
+            # wait for the worker so disconnect() below cleans up whatever it already started.
+            self.root.withdraw()
+            self.root.after(100, self.shutdown)
+            return
         self.disconnect()
         try:
             self.tray.remove()
@@ -701,6 +1784,9 @@ class VPNApp:
                 continue
             total = query_xray_stats_kbps()
             now = time.time()
+            if now - self.last_resource_sample >= RESOURCE_SAMPLE_INTERVAL:
+                self.last_resource_sample = now
+                self._sample_resources(total)
 
             if total is None:
                 self.root.after(0, lambda: self.speed_label.config(text="0.00 Kbps"))
@@ -718,13 +1804,68 @@ class VPNApp:
 
             self.last_total_bytes = total
             self.last_sample_time = now
+            self.session_bytes += delta_bytes
+            self.session_seconds += delta_time
+            self.session_peak_kbps = max(self.session_peak_kbps, kbps)
 
             self.root.after(0, lambda value=kbps: self.speed_label.config(text=f"{value:.2f} Kbps"))
 
+    def _sample_resources(self, total: float | None):
+        proc = self.xray_proc
+        if proc is None or self.resources.sample(proc.pid, total) is None:
+            return
+        summary = self.resources.summary()
+        try:
+            save_json(METRICS_PATH, summary)
+        except OSError:
+            pass
+
+        text = f"RSS {summary['rss_mb']:.0f} MB · CPU {summary.get('cpu_pct', 0.0):.0f}% · thr {summary['threads']}"
+        color = "#888888"
+        if summary["anomalies"]:
+            text += "\n" + ", ".join(summary["anomalies"])
+            color = "#d08a3a"
+        self.root.after(0, lambda: self.resource_label.config(text=text, fg=color))
+
     def run(self):
         self.root.mainloop()
 
 
+def main_cli(argv: list[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="app.py")
+    parser.add_argument("--bench-pac", action="store_true", help="замер компиляции и поиска по PAC-спискам")
+    parser.add_argument("--bench-catalog", action="store_true", help="замер индексов каталога узлов")
+    parser.add_argument("--nodes", type=Path, help="файл со списком vless:// URI, по одному на строку")
+    parser.add_argument("--type")
+    parser.add_argument("--security")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--remark")
+    parser.add_argument("--max-latency", type=float)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--probe", action="store_true", help="измерить TCP-задержку перед выборкой")
+    parser.add_argument("--probe-limit", type=int, default=NODE_PROBE_LIMIT, help="сколько неизмеренных узлов проверять")
+    args = parser.parse_args(argv)
+
+    if args.bench_pac:
+        print(json.dumps(benchmark_pac(), indent=2))
+    if args.bench_catalog:
+        print(json.dumps(benchmark_catalog(), indent=2))
+    if args.nodes:
+        catalog = NodeCatalog()
+        catalog.sync(read_node_list(args.nodes))
+        filters = {"type": args.type, "security": args.security, "host": args.host, "port": args.port, "remark": args.remark}
+        if args.probe:
+            probe_catalog(catalog, probe_candidates(catalog, filters, args.probe_limit))
+        for node in catalog.query(max_latency=args.max_latency, limit=args.limit, **filters):
+            print(json.dumps(node, ensure_ascii=False))
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_cli(sys.argv[1:]))
     app = VPNApp()
     app.run()
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import app
+
+
+def make_uris(count, seed=1):
+    # reality always comes with tcp, so reality+grpc is empty although both filters are broad.
+    rnd = random.Random(seed)
+    uris = []
+    for i in range(count):
+        security = rnd.choice(["reality", "tls", "none"])
+        network = "tcp" if security == "reality" else rnd.choice(["tcp", "ws", "grpc"])
+        uris.append(f"vless://id{i}@n{i % 5000}.example.com:{rnd.choice([443, 8443])}?security={security}&type={network}#node-{i % 500}")
+    return uris
+
+
+@pytest.fixture(scope="module")
+def big_catalog():
+    rnd = random.Random(2)
+    catalog = app.NodeCatalog()
+    uris = make_uris(50000)
+    catalog.sync(uris)
+    for uri in uris:
+        catalog.record_latency(uri, rnd.uniform(20, 400))
+    return catalog
+
+
+def brute_force(catalog, max_latency=None, limit=None, **filters):
+    rows = [
+        n
+        for n in catalog.nodes.values()
+        if all(v is None or str(n[f]) == str(v).lower() for f, v in filters.items())
+        and n["latency"] is not None
+        and (max_latency is None or n["latency"] <= max_latency)
+    ]
+    rows.sort(key=lambda n: (n["latency"], n["uri"]))
+    return rows[:limit]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"security": "reality", "type": "tcp", "max_latency": 150, "limit": 20},
+        {"security": "reality", "type": "grpc", "max_latency": 150, "limit": 20},
+        {"security": "tls", "type": "grpc", "limit": 20},
+        {"host": "n42.example.com", "max_latency": 400, "limit": 20},
+        {"remark": "node-5", "limit": 20},
+        {"remark": "node-5", "port": 443, "max_latency": 100, "limit": 5},
+        {"host": "missing.example.com", "limit": 20},
+    ],
+)
+def test_query_matches_brute_force(big_catalog, query):
+    assert big_catalog.query(**query) == brute_force(big_catalog, **query)
+
+
+def test_unmeasured_nodes_keep_subscription_order():
+    catalog = app.NodeCatalog()
+    uris = make_uris(300)
+    catalog.sync(uris)
+    expected = [u for u in uris if "security=tls" in u][:10]
+    assert [n["uri"] for n in catalog.query(security="tls", limit=10)] == expected
+    assert [n["uri"] for n in catalog.query(limit=5)] == uris[:5]
+
+
+def test_sync_is_incremental():
+    catalog = app.NodeCatalog()
+    uris = make_uris(100)
+    assert catalog.sync(uris) == (100, 0)
+    catalog.record_latency(uris[0], 10)
+    assert catalog.sync(uris[1:] + ["vless://new@h:443#x"]) == (1, 1)
+    assert catalog.by_latency == []
+    assert uris[0] not in catalog.index["remark"].get("node-0", set())
+
+
+def test_select_node_skips_dead_nodes(monkeypatch):
+    catalog = app.NodeCatalog()
+    dead = [f"vless://d{i}@dead{i}.example:443#dead" for i in range(100)]
+    live = "vless://l@live.example:443#live"
+    catalog.sync(dead + [live])
+    probed = []
+
+    def fake_probe(host, port, timeout=2.0):
+        probed.append(host)
+        return 30.0 if host == "live.example" else None
+
+    monkeypatch.setattr(app, "probe_tcp_latency", fake_probe)
+
+    assert app.select_node(catalog, {}, probe_limit=32) is None
+    picks = [app.select_node(catalog, {}, probe_limit=32) for _ in range(4)]
+    assert picks[-1]["uri"] == live
+    assert len(probed) == len(set(probed)) == 101
@@ -0,0 +1,81 @@
+import shutil
+
+import pytest
+
+import app
+
+ENTRIES = app.DEFAULT_PAC_BYPASS + ["*.corp.example", ".intra.example", "8.8.8.0/24", "8.8.9.0/24", "2001:db8:aa::/48"]
+
+HOSTS = [
+    "a.corp.example",
+    "corp.example",
+    "xcorp.example",
+    "deep.a.intra.example",
+    "foo.local",
+    "foo.local.",
+    "intranet",
+    "google.com",
+    "8.8.8.8",
+    "8.8.9.255",
+    "8.8.10.1",
+    "08.8.8.8",
+    "999.1.1.1",
+    "10.2.3.4",
+    "192.168.1.1",
+    "::1",
+    "[::1]",
+    "2001:db8::1",
+    "[2606:4700::1111]",
+    "2001:db8:aa::5",
+    "fe80::1%eth0",
+    "::ffff:10.0.0.1",
+    "1:2:3:4:5:6:7:8:9",
+]
+
+
+def test_compile_bypass_splits_and_merges():
+    compiled = app.compile_bypass(["*.Corp.Example", ".b.example", "# comment", "", "8.8.8.0/24", "8.8.9.0/24", "1.1.1.1", "::1"])
+    assert compiled["suffixes"] == {"corp.example", "b.example"}
+    assert list(zip(compiled["v4_starts"], compiled["v4_ends"])) == [(16843009, 16843009), (134744064, 134744575)]
+    assert compiled["v6_starts"] == ["0" * 31 + "1"]
+
+
+@pytest.mark.parametrize(
+    "host,direct",
+    [
+        ("a.corp.example", True),
+        ("xcorp.example", False),
+        ("intranet", True),
+        ("8.8.9.255", True),
+        ("8.8.10.1", False),
+        ("08.8.8.8", True),
+        ("2001:db8::1", False),
+        ("[2606:4700::1111]", False),
+        ("[::1]", True),
+        ("2001:db8:aa::5", True),
+    ],
+)
+def test_bypass_matches(host, direct):
+    assert app.bypass_matches(host, app.compile_bypass(ENTRIES)) is direct
+
+
+def test_ipv6_hex_matches_ipaddress():
+    for literal in ["::1", "2001:db8::1", "fe80::1:2", "1:2:3:4:5:6:7:8"]:
+        assert app.ipv6_hex(literal) == f"{int(app.ipaddress.IPv6Address(literal)):032x}"
+    assert app.ipv6_hex("1::2::3") is None
+    assert app.ipv6_hex("1:2:3") is None
+
+
+def test_build_pac_script_embeds_lookup_tables():
+    script = app.build_pac_script(ENTRIES, proxy="PROXY 127.0.0.1:1")
+    assert "function FindProxyForURL(url, host)" in script
+    assert '"corp.example":1' in script
+    assert 'return "PROXY 127.0.0.1:1";' in script
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_pac_script_agrees_with_mirror():
+    compiled = app.compile_bypass(ENTRIES)
+    evaluated = app.eval_pac_with_node(app.render_pac_script(compiled), HOSTS)
+    expected = ["DIRECT" if app.bypass_matches(h, compiled) else f"PROXY 127.0.0.1:{app.LOCAL_HTTP_PORT}" for h in HOSTS]
+    assert evaluated["results"] == expected
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+import app
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="/proc sampler")
+def test_read_process_resources_linux():
+    sample = app.read_process_resources(os.getpid())
+    assert sample["rss_bytes"] > 0
+    assert sample["threads"] >= 1
+    assert sample["handles"] >= 3
+    assert sample["cpu_seconds"] > 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="/proc sampler")
+def test_unknown_traffic_total_is_skipped():
+    monitor = app.ResourceMonitor()
+    assert monitor.sample(os.getpid(), None) is None
+    assert monitor.sample(os.getpid(), 1000.0) is not None
+    assert len(monitor.samples) == 1
+
+
+def test_summary_flags_memory_growth_per_gb():
+    monitor = app.ResourceMonitor()
+    base = {"threads": 10, "handles": 50}
+    monitor.samples.append(dict(base, time=0.0, cpu_seconds=0.0, rss_bytes=100 << 20, total_bytes=0.0))
+    monitor.samples.append(dict(base, time=100.0, cpu_seconds=5.0, rss_bytes=300 << 20, total_bytes=1e9))
+    summary = monitor.summary()
+    assert summary["rss_mb_per_gb"] == 200.0
+    assert summary["cpu_pct"] == 5.0
+    assert summary["mbps"] == 80.0
+    assert any(a.startswith("RSS") for a in summary["anomalies"])
@@ -0,0 +1,33 @@
+import pytest
+
+import app
+
+PROFILE = {"vless_uri": "vless://id@node.example:443?security=reality&type=tcp#n"}
+
+
+@pytest.mark.parametrize("value,expected", [("auto", 1500), (1400, 1400), ("1400", 1400), (1280, 1280)])
+def test_tun_mtu_accepted(value, expected):
+    assert app.tun_settings(dict(PROFILE, tun_mtu=value))["mtu"] == expected
+
+
+@pytest.mark.parametrize("value", [True, 9000, 1279, "x", 1400.5])
+def test_tun_mtu_rejected(value):
+    with pytest.raises(ValueError):
+        app.tun_settings(dict(PROFILE, tun_mtu=value))
+
+
+def test_discovered_mtu_only_applies_to_auto():
+    assert app.tun_settings(PROFILE, 1420)["mtu"] == 1420
+    assert app.tun_settings(dict(PROFILE, tun_mtu=1300), 1420)["mtu"] == 1300
+
+
+def test_sniffing_follows_domain_rules():
+    inbound = app.build_xray_config(PROFILE, True)["inbounds"][-1]
+    assert "sniffing" not in inbound
+
+    profile = dict(PROFILE, routing_rules=[{"domain": ["domain:corp.example"], "outboundTag": "direct"}])
+    config = app.build_xray_config(profile, True)
+    assert config["inbounds"][-1]["sniffing"]["routeOnly"] is True
+    assert config["routing"]["rules"][-1] == {"type": "field", "domain": ["domain:corp.example"], "outboundTag": "direct"}
+
+    assert "sniffing" not in app.build_xray_config(dict(profile, tun_sniffing=False), True)["inbounds"][-1]